@@ -6,10 +6,25 @@
 # 3. Servidor Web (Flask) para o "Web Service" gratuito do Render
 # 4. Jobs Agendados (Aniversário, Abandono, Renovação)
 # 5. CORREÇÃO: Adiciona event loop de asyncio para o thread do bot
+# 6. Logging estruturado via fila (thread escritor), com amostragem nos jobs e máscara de PII
+# 7. Banco: uma conexão/transação por handler ou job, com consultas preparadas
+# 8. Perfil opcional: spans por update (DB/Telegram/CPU) e amostragem de pilhas (/perfil)
 
 import logging
+import logging.handlers
 import psycopg2 
 import os
+import re
+import io
+import json
+import queue
+import atexit
+import sys
+import time
+import functools
+import contextlib
+import contextvars
+import collections
 from datetime import datetime, timedelta
 import threading
 import asyncio # <-- NOVO IMPORT para o "relógio" do bot
@@ -25,6 +40,7 @@ from telegram.ext import (
     CallbackQueryHandler,
     filters,
 )
+from telegram.request import HTTPXRequest
 
 # --- CONFIGURAÇÕES PRINCIPAIS (OBRIGATÓRIO NO RENDER) ---
 TOKEN = os.environ.get("TELEGRAM_TOKEN")
@@ -36,27 +52,474 @@ DIAS_ASSINATURA = int(os.environ.get("DIAS_ASSINATURA", 30))
 DIAS_AVISO_RENOVACAO = int(os.environ.get("DIAS_AVISO_RENOVACAO", 3))
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
+
+LOG_FORMATO = os.environ.get("LOG_FORMATO", "texto")  # "texto" ou "json"
+LOG_AMOSTRA_JOBS = int(os.environ.get("LOG_AMOSTRA_JOBS", 5))
+
+PERFIL_ATIVO = os.environ.get("PERFIL_ATIVO", "0") == "1"
+PERFIL_LIMIAR_MS = float(os.environ.get("PERFIL_LIMIAR_MS", 1000))
+PERFIL_INTERVALO_MS = float(os.environ.get("PERFIL_INTERVALO_MS", 10))
+PERFIL_AMOSTRA_MAX_S = 300
 # -----------------------------------------------
 
-# Configuração de logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
+# --- LOGGING ESTRUTURADO (FORA DO EVENT LOOP) ---
+# Os handlers só colocam o registro numa fila; formatação, mascaramento de PII
+# e escrita acontecem no thread do QueueListener.
+
+_REGEX_EMAIL = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+_ATRIBUTOS_PADRAO = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+def _mascara_email(valor):
+    """Troca e-mails por 'x***@dominio' para não vazar PII nos logs."""
+    return _REGEX_EMAIL.sub(lambda m: m.group(0)[0] + "***@" + m.group(0).rsplit("@", 1)[1], valor)
+
+class FiltroPII(logging.Filter):
+    """Mascara e-mails na mensagem já formatada e no traceback."""
+
+    def filter(self, record):
+        # Mascara o resultado final: argumentos como exceções do psycopg2 também trazem e-mails.
+        record.msg = _mascara_email(record.getMessage())
+        record.args = ()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        if record.exc_text:
+            record.exc_text = _mascara_email(record.exc_text)
+        if record.stack_info:
+            record.stack_info = _mascara_email(record.stack_info)
+        return True
+
+class FormatadorJSON(logging.Formatter):
+    """Uma linha JSON por registro, incluindo os campos passados em `extra`."""
+
+    def format(self, record):
+        dados = {
+            "ts": self.formatTime(record),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        dados.update({k: v for k, v in vars(record).items() if k not in _ATRIBUTOS_PADRAO})
+        if record.exc_text:
+            dados["exc"] = record.exc_text
+        elif record.exc_info:
+            dados["exc"] = self.formatException(record.exc_info)
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+class QueueHandlerPreguicoso(logging.handlers.QueueHandler):
+    """QueueHandler que não formata a mensagem no thread de origem; o listener formata depois.
+
+    Isso pressupõe argumentos imutáveis (ids, strings, exceções): um objeto mutável
+    alterado antes de o listener formatar aparece no log já alterado.
+    """
+
+    def prepare(self, record):
+        # O traceback vira texto aqui, para não manter frames vivos dentro da fila.
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def configurar_logging():
+    """Liga o root logger a uma fila e inicia o thread escritor. Retorna o listener."""
+    handler_saida = logging.StreamHandler()
+    if LOG_FORMATO == "json":
+        handler_saida.setFormatter(FormatadorJSON())
+    else:
+        handler_saida.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    handler_saida.addFilter(FiltroPII())
+
+    fila = queue.SimpleQueue()
+    raiz = logging.getLogger()
+    raiz.handlers[:] = [QueueHandlerPreguicoso(fila)]
+    raiz.setLevel(logging.INFO)
+
+    listener = logging.handlers.QueueListener(fila, handler_saida, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+class AmostradorLog:
+    """Loga só as primeiras linhas por usuário de uma execução de job e resume o restante.
+
+    Erros são sempre logados; `resumo()` emite uma linha agregada ao final da execução.
+    """
+
+    def __init__(self, job, limite=LOG_AMOSTRA_JOBS):
+        self.job = job
+        self.limite = limite
+        self.processados = 0
+        self.erros = 0
+
+    def _amostra(self, nivel, msg, args, extra):
+        self.processados += 1
+        if self.processados <= self.limite:
+            logger.log(nivel, msg, *args, extra={"job": self.job, **extra})
+
+    def info(self, msg, *args, **extra):
+        self._amostra(logging.INFO, msg, args, extra)
+
+    def aviso(self, msg, *args, **extra):
+        self._amostra(logging.WARNING, msg, args, extra)
+
+    def erro(self, msg, *args, **extra):
+        self.erros += 1
+        logger.error(msg, *args, extra={"job": self.job, **extra})
+
+    def resumo(self):
+        omitidos = max(0, self.processados - self.limite)
+        logger.info(
+            "[Job] %s concluído: %d processados (%d omitidos do log), %d erros",
+            self.job, self.processados, omitidos, self.erros,
+            extra={"job": self.job, "processados": self.processados, "erros": self.erros},
+        )
+
+configurar_logging()
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
+# --- PERFIL (SPANS POR UPDATE E AMOSTRAGEM DE PILHAS) ---
+# Todo handler/job registrado em run_bot passa por `perfilado`. Com o perfil ligado,
+# cada execução acumula o tempo gasto no banco e na API do Telegram; o restante é
+# contado como CPU (Python + espera no event loop). Execuções acima do limiar são logadas.
+
+ESTADO_PERFIL = {"ativo": PERFIL_ATIVO, "limiar_ms": PERFIL_LIMIAR_MS, "amostrando": False}
+
+_SPAN_ATUAL = contextvars.ContextVar("span_atual", default=None)
+
+@contextlib.contextmanager
+def span(tipo):
+    """Soma a duração do bloco em `tipo` ("db" ou "telegram") no span do update corrente."""
+    atual = _SPAN_ATUAL.get()
+    if atual is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        atual[tipo] += time.perf_counter() - inicio
+
+def perfilado(callback):
+    """Envolve um callback de handler/job para medir o span quando o perfil está ligado."""
+    nome = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        if not ESTADO_PERFIL["ativo"]:
+            return await callback(*args, **kwargs)
+        atual = {"db": 0.0, "telegram": 0.0}
+        token = _SPAN_ATUAL.set(atual)
+        inicio = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            total_ms = (time.perf_counter() - inicio) * 1000
+            _SPAN_ATUAL.reset(token)
+            if total_ms >= ESTADO_PERFIL["limiar_ms"]:
+                db_ms, telegram_ms = atual["db"] * 1000, atual["telegram"] * 1000
+                cpu_ms = max(0.0, total_ms - db_ms - telegram_ms)
+                update_id = args[0].update_id if args and isinstance(args[0], Update) else None
+                logger.warning(
+                    "Update lento em %s: %.0f ms (db %.0f ms, telegram %.0f ms, cpu %.0f ms)",
+                    nome, total_ms, db_ms, telegram_ms, cpu_ms,
+                    extra={"handler": nome, "update_id": update_id, "total_ms": round(total_ms, 1),
+                           "db_ms": round(db_ms, 1), "telegram_ms": round(telegram_ms, 1), "cpu_ms": round(cpu_ms, 1)},
+                )
+
+    return wrapper
+
+def instrumenta_handlers(application):
+    """Aplica `perfilado` a todo handler já registrado, inclusive dentro de ConversationHandler."""
+    def envolve(handlers):
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                envolve(handler.entry_points)
+                envolve(handler.fallbacks)
+                for lista in handler.states.values():
+                    envolve(lista)
+            else:
+                handler.callback = perfilado(handler.callback)
+
+    for grupo in application.handlers.values():
+        envolve(grupo)
+
+class RequestCronometrado(HTTPXRequest):
+    """HTTPXRequest que soma o tempo de cada chamada à API do Telegram no span corrente."""
+
+    async def do_request(self, *args, **kwargs):
+        with span("telegram"):
+            return await super().do_request(*args, **kwargs)
+
+def amostra_pilhas(thread_id, segundos, intervalo=PERFIL_INTERVALO_MS / 1000):
+    """Amostra a pilha do thread `thread_id` por `segundos`.
+
+    Devolve um Counter de pilhas no formato "folded" (frames separados por ';'),
+    pronto para flamegraph.pl, speedscope ou inferno.
+    """
+    contagens = collections.Counter()
+    fim = time.monotonic() + segundos
+    while time.monotonic() < fim:
+        frame = sys._current_frames().get(thread_id)
+        if frame is None:
+            break
+        pilha = []
+        while frame is not None:
+            codigo = frame.f_code
+            pilha.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})")
+            frame = frame.f_back
+        contagens[";".join(reversed(pilha))] += 1
+        time.sleep(intervalo)
+    return contagens
+
+def formata_flamegraph(contagens):
+    """Formata as contagens de `amostra_pilhas` como linhas "pilha contagem"."""
+    return "".join(f"{pilha} {total}\n" for pilha, total in contagens.most_common())
+
 # --- ESTADOS DA CONVERSA DE CADASTRO ---
 (EMAIL, ANIVERSARIO, CONFIRMACAO) = range(3)
 (PENDENTE_PAGAMENTO,) = range(3, 4) 
 
 # --- FUNÇÕES DO BANCO DE DADOS (PostgreSQL / Neon) ---
-# (Todo o código do banco de dados está correto e permanece o mesmo)
+# Cada handler/job abre uma única UnidadeDeTrabalho: uma conexão do pool, uma transação.
+# As consultas fixas ficam em CONSULTAS e são preparadas no servidor (PREPARE) na
+# primeira vez que cada conexão do pool as usa; as unidades seguintes só fazem EXECUTE.
+
+# O pooler do Neon (PgBouncer em modo transação) não aceita PREPARE via SQL.
+DB_USA_PREPARE = os.environ.get("DB_USA_PREPARE", "1") == "1" and "-pooler" not in (DATABASE_URL or "")
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", 5))
+
+# nome -> (tipos dos parâmetros, SQL com $1..$n)
+CONSULTAS = {
+    "busca_usuario": ("bigint", "SELECT * FROM usuarios WHERE user_id = $1"),
+    "salva_cadastro": (
+        "bigint, text, text, date, timestamp",
+        """INSERT INTO usuarios (user_id, telegram_username, email, data_aniversario, status, data_cadastro, data_expiracao)
+        VALUES ($1, $2, $3, $4, 'pendente_pagamento', $5, NULL)
+        ON CONFLICT (user_id) DO UPDATE SET
+            telegram_username = EXCLUDED.telegram_username,
+            email = EXCLUDED.email,
+            data_aniversario = EXCLUDED.data_aniversario,
+            status = 'pendente_pagamento',
+            data_expiracao = NULL""",
+    ),
+    "atualiza_status": (
+        "bigint, text",
+        "UPDATE usuarios SET status = $2 WHERE user_id = $1 RETURNING email",
+    ),
+    # Troca o status só se o atual estiver entre os permitidos; sem linha = transição negada.
+    "troca_status_se": (
+        "bigint, text, text[]",
+        "UPDATE usuarios SET status = $2 WHERE user_id = $1 AND status = ANY($3) RETURNING email",
+    ),
+    "ativa_ate": (
+        "bigint, timestamp",
+        "UPDATE usuarios SET status = 'membro_ativo', data_expiracao = $2 WHERE user_id = $1",
+    ),
+    # Renovação: estende a partir da expiração atual (ou de agora, se já passou) numa só ida ao banco.
+    "renova": (
+        "bigint, timestamp, integer",
+        """UPDATE usuarios SET status = 'membro_ativo',
+            data_expiracao = GREATEST($2, data_expiracao) + make_interval(days => $3)
+        WHERE user_id = $1 RETURNING data_expiracao""",
+    ),
+    "restaura_status_renovacao": (
+        "bigint, timestamp",
+        """UPDATE usuarios SET status = CASE WHEN data_expiracao > $2 THEN 'membro_ativo' ELSE 'expirado' END
+        WHERE user_id = $1""",
+    ),
+    "busca_aviso_renovacao": (
+        "timestamp",
+        "SELECT user_id, data_expiracao FROM usuarios WHERE status = 'membro_ativo' AND data_expiracao <= $1",
+    ),
+    # Reivindica os vencidos como 'removendo'; cada um só vira 'expirado' depois da remoção
+    # no Telegram. Sobras de uma execução interrompida são pegas de novo na próxima.
+    "reivindica_vencidos": (
+        "timestamp",
+        """UPDATE usuarios SET status = 'removendo'
+        WHERE (status = 'membro_ativo' AND data_expiracao < $1) OR status = 'removendo'
+        RETURNING user_id, telegram_username""",
+    ),
+    "busca_aniversariantes": (
+        "",
+        """SELECT user_id, telegram_username
+        FROM usuarios
+        WHERE EXTRACT(MONTH FROM data_aniversario) = EXTRACT(MONTH FROM CURRENT_DATE)
+        AND EXTRACT(DAY FROM data_aniversario) = EXTRACT(DAY FROM CURRENT_DATE)""",
+    ),
+}
+
+_REGEX_PARAMETRO = re.compile(r"\$(\d+)")
+
+class ConexaoPreparada(psycopg2.extensions.connection):
+    """Conexão que lembra quais consultas de CONSULTAS já foram preparadas nela."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preparadas = set()
 
 def get_db_connection():
     """Estabelece uma nova conexão com o banco de dados Neon."""
-    conn = psycopg2.connect(DATABASE_URL)
+    with span("db"):
+        conn = psycopg2.connect(DATABASE_URL, connection_factory=ConexaoPreparada)
     return conn
 
+class PoolConexoes:
+    """Guarda até DB_POOL_MAX conexões abertas para reaproveitar entre unidades de trabalho."""
+
+    def __init__(self, maximo=DB_POOL_MAX):
+        self.maximo = maximo
+        self._livres = []
+        self._lock = threading.Lock()
+
+    def pega(self):
+        with self._lock:
+            while self._livres:
+                conn = self._livres.pop()
+                if not conn.closed:
+                    return conn
+        return get_db_connection()
+
+    def devolve(self, conn, descarta=False):
+        with self._lock:
+            if not descarta and not conn.closed and len(self._livres) < self.maximo:
+                self._livres.append(conn)
+                return
+        if not conn.closed:
+            conn.close()
+
+POOL = PoolConexoes()
+
+class UnidadeDeTrabalho:
+    """Uma conexão e uma transação para todo o trabalho de banco de um handler ou job.
+
+    Faz commit ao sair do bloco `with` sem erro e rollback caso contrário.
+    `round_trips` conta as idas ao banco (BEGIN, cada consulta e o COMMIT);
+    `total_round_trips` acumula o mesmo para todas as unidades do processo.
+    """
+
+    total_round_trips = 0
+
+    def __init__(self):
+        self.conn = None
+        self.round_trips = 0
+        self.descarta_conexao = False
+
+    def __enter__(self):
+        self.conn = POOL.pega()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        descarta = self.descarta_conexao or (
+            exc_type is not None and issubclass(exc_type, (psycopg2.OperationalError, psycopg2.InterfaceError))
+        )
+        try:
+            if not descarta:
+                # Rollback sempre que houve erro, mesmo na primeira consulta: a conexão
+                # não pode voltar ao pool com a transação abortada.
+                with span("db"):
+                    if exc_type is not None:
+                        self.conn.rollback()
+                    elif self.round_trips:
+                        self.conn.commit()
+                if self.round_trips:
+                    self.round_trips += 1
+                if self.conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    descarta = True
+        except Exception:
+            descarta = True
+            raise
+        finally:
+            POOL.devolve(self.conn, descarta=descarta)
+            UnidadeDeTrabalho.total_round_trips += self.round_trips
+            logger.debug("Unidade de trabalho encerrada com %d round trips", self.round_trips)
+        return False
+
+    def _executa(self, nome, *params):
+        """Executa a consulta `nome` de CONSULTAS e devolve o cursor."""
+        if self.round_trips == 0:
+            try:
+                return self._executa_na_conexao(nome, params)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                # Conexão do pool derrubada pelo servidor (ex.: compute do Neon suspenso): tenta uma nova.
+                POOL.devolve(self.conn, descarta=True)
+                self.conn = get_db_connection()
+                self.descarta_conexao = False
+        return self._executa_na_conexao(nome, params)
+
+    def _executa_na_conexao(self, nome, params):
+        tipos, sql = CONSULTAS[nome]
+        cursor = self.conn.cursor()
+        if DB_USA_PREPARE:
+            comando = f"EXECUTE {nome}({', '.join(['%s'] * len(params))})" if params else f"EXECUTE {nome}"
+            if nome not in self.conn.preparadas:
+                assinatura = f" ({tipos})" if tipos else ""
+                comando = f"PREPARE {nome}{assinatura} AS {sql}; {comando}"
+            try:
+                with span("db"):
+                    cursor.execute(comando, params)
+            except Exception:
+                # PREPARE não é desfeito pelo rollback: não dá para saber se ficou preparada.
+                self.descarta_conexao = True
+                raise
+            self.conn.preparadas.add(nome)
+        else:
+            with span("db"):
+                cursor.execute(_REGEX_PARAMETRO.sub(r"%(p\1)s", sql), {f"p{i}": p for i, p in enumerate(params, 1)})
+        if self.round_trips == 0:
+            self.round_trips += 1  # BEGIN implícito do psycopg2
+        self.round_trips += 1
+        return cursor
+
+    def busca_usuario(self, user_id):
+        """Devolve os dados do usuário como dict, ou None."""
+        cursor = self._executa("busca_usuario", user_id)
+        colnames = [desc[0] for desc in cursor.description]
+        row = cursor.fetchone()
+        return dict(zip(colnames, row)) if row else None
+
+    def salva_cadastro(self, user_id, telegram_username, email, data_aniversario):
+        """Insere ou reinicia o cadastro como 'pendente_pagamento'."""
+        self._executa("salva_cadastro", user_id, telegram_username, email, data_aniversario, datetime.now())
+
+    def atualiza_status(self, user_id, novo_status):
+        """Atualiza o status e devolve o e-mail do usuário (None se ele não existe)."""
+        row = self._executa("atualiza_status", user_id, novo_status).fetchone()
+        return row[0] if row else None
+
+    def troca_status_se(self, user_id, novo_status, status_permitidos):
+        """Muda o status só se o atual estiver em `status_permitidos`.
+
+        Devolve (True, email) se a troca aconteceu, (False, None) caso contrário.
+        """
+        row = self._executa("troca_status_se", user_id, novo_status, list(status_permitidos)).fetchone()
+        return (True, row[0]) if row else (False, None)
+
+    def ativa_ate(self, user_id, data_expiracao):
+        """Deixa o usuário como 'membro_ativo' até `data_expiracao`."""
+        self._executa("ativa_ate", user_id, data_expiracao)
+
+    def renova(self, user_id, dias):
+        """Estende a assinatura em `dias` e devolve a nova expiração (None se o usuário não existe)."""
+        row = self._executa("renova", user_id, datetime.now(), dias).fetchone()
+        return row[0] if row else None
+
+    def restaura_status_renovacao(self, user_id):
+        """Volta para 'membro_ativo' se a assinatura ainda vale, senão para 'expirado'."""
+        self._executa("restaura_status_renovacao", user_id, datetime.now())
+
+    def busca_aviso_renovacao(self, data_aviso):
+        """Lista (user_id, data_expiracao) dos ativos que expiram até `data_aviso`."""
+        return self._executa("busca_aviso_renovacao", data_aviso).fetchall()
+
+    def reivindica_vencidos(self):
+        """Marca como 'removendo' os ativos vencidos (e devolve também os que já estavam assim)."""
+        return self._executa("reivindica_vencidos", datetime.now()).fetchall()
+
+    def busca_aniversariantes(self):
+        """Lista (user_id, telegram_username) de quem faz aniversário hoje."""
+        return self._executa("busca_aniversariantes").fetchall()
+
 def inicializar_db():
     """Cria a tabela de usuários se ela não existir."""
     conn = None
@@ -78,130 +541,79 @@ def inicializar_db():
         cursor.close()
         logger.info("Banco de dados inicializado com sucesso.")
     except Exception as e:
-        logger.error(f"Erro ao inicializar DB: {e}")
+        logger.error("Erro ao inicializar DB: %s", e)
     finally:
         if conn:
             conn.close()
 
 def get_user_data(user_id):
     """Puxa todos os dados de um usuário."""
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM usuarios WHERE user_id = %s", (user_id,))
-        colnames = [desc[0] for desc in cursor.description]
-        row = cursor.fetchone()
-        cursor.close()
-        if row:
-            return dict(zip(colnames, row))
-        return None
+        with UnidadeDeTrabalho() as uow:
+            return uow.busca_usuario(user_id)
     except Exception as e:
-        logger.error(f"Erro ao buscar usuário {user_id}: {e}")
+        logger.error("Erro ao buscar usuário %s: %s", user_id, e)
         return None
-    finally:
-        if conn:
-            conn.close()
 
 def update_user_data(user_id, telegram_username, email, data_aniversario):
     """Insere ou atualiza os dados do mini-cadastro."""
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        data_hoje = datetime.now()
-        cursor.execute("""
-        INSERT INTO usuarios (user_id, telegram_username, email, data_aniversario, status, data_cadastro, data_expiracao)
-        VALUES (%s, %s, %s, %s, 'pendente_pagamento', %s, NULL)
-        ON CONFLICT (user_id) DO UPDATE SET
-            telegram_username = EXCLUDED.telegram_username,
-            email = EXCLUDED.email,
-            data_aniversario = EXCLUDED.data_aniversario,
-            status = 'pendente_pagamento',
-            data_expiracao = NULL
-        """, (user_id, telegram_username, email, data_aniversario, data_hoje))
-        conn.commit()
-        cursor.close()
+        with UnidadeDeTrabalho() as uow:
+            uow.salva_cadastro(user_id, telegram_username, email, data_aniversario)
     except Exception as e:
-        logger.error(f"Erro ao atualizar dados de {user_id}: {e}")
-    finally:
-        if conn:
-            conn.close()
+        logger.error("Erro ao atualizar dados de %s: %s", user_id, e)
 
 def update_user_status(user_id, novo_status):
-    """Atualiza apenas o status do usuário."""
-    conn = None
+    """Atualiza apenas o status do usuário e devolve o e-mail cadastrado (ou None)."""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("UPDATE usuarios SET status = %s WHERE user_id = %s", (novo_status, user_id))
-        conn.commit()
-        cursor.close()
+        with UnidadeDeTrabalho() as uow:
+            return uow.atualiza_status(user_id, novo_status)
     except Exception as e:
-        logger.error(f"Erro ao atualizar status de {user_id}: {e}")
-    finally:
-        if conn:
-            conn.close()
+        logger.error("Erro ao atualizar status de %s: %s", user_id, e)
+        return None
+
+def update_user_status_se(user_id, novo_status, status_permitidos):
+    """Atualiza o status só se o atual estiver em `status_permitidos`. Devolve (trocou, email)."""
+    try:
+        with UnidadeDeTrabalho() as uow:
+            return uow.troca_status_se(user_id, novo_status, status_permitidos)
+    except Exception as e:
+        logger.error("Erro ao atualizar status de %s: %s", user_id, e)
+        return (False, None)
 
 def update_user_expiry(user_id, nova_data_expiracao):
     """Atualiza a data de expiração e o status de um usuário."""
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE usuarios SET status = 'membro_ativo', data_expiracao = %s WHERE user_id = %s", 
-            (nova_data_expiracao, user_id)
-        )
-        conn.commit()
-        cursor.close()
+        with UnidadeDeTrabalho() as uow:
+            uow.ativa_ate(user_id, nova_data_expiracao)
     except Exception as e:
-        logger.error(f"Erro ao atualizar expiração de {user_id}: {e}")
-    finally:
-        if conn:
-            conn.close()
+        logger.error("Erro ao atualizar expiração de %s: %s", user_id, e)
 
-def get_users_para_aviso_renovacao():
-    """Busca usuários ativos cuja expiração está próxima."""
-    conn = None
+def renova_assinatura(user_id):
+    """Estende a assinatura em DIAS_ASSINATURA e devolve a nova data (None se falhou ou o usuário não existe)."""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        data_aviso = datetime.now() + timedelta(days=DIAS_AVISO_RENOVACAO)
-        cursor.execute(
-            "SELECT user_id, data_expiracao FROM usuarios WHERE status = 'membro_ativo' AND data_expiracao <= %s",
-            (data_aviso,)
-        )
-        usuarios = cursor.fetchall()
-        cursor.close()
-        return usuarios
+        with UnidadeDeTrabalho() as uow:
+            return uow.renova(user_id, DIAS_ASSINATURA)
     except Exception as e:
-        logger.error(f"Erro ao buscar usuários para aviso: {e}")
-        return []
-    finally:
-        if conn:
-            conn.close()
+        logger.error("Erro ao renovar assinatura de %s: %s", user_id, e)
+        return None
 
-def get_users_expirados():
-    """Busca usuários ativos cuja data de expiração já passou."""
-    conn = None
+def restaura_status_apos_recusa(user_id):
+    """Volta o usuário para 'membro_ativo' se a assinatura ainda vale, senão para 'expirado'."""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        agora = datetime.now()
-        cursor.execute(
-            "SELECT user_id, telegram_username FROM usuarios WHERE status = 'membro_ativo' AND data_expiracao < %s",
-            (agora,)
-        )
-        usuarios = cursor.fetchall()
-        cursor.close()
-        return usuarios
+        with UnidadeDeTrabalho() as uow:
+            uow.restaura_status_renovacao(user_id)
+    except Exception as e:
+        logger.error("Erro ao restaurar status de %s: %s", user_id, e)
+
+def get_users_para_aviso_renovacao():
+    """Busca usuários ativos cuja expiração está próxima."""
+    try:
+        with UnidadeDeTrabalho() as uow:
+            return uow.busca_aviso_renovacao(datetime.now() + timedelta(days=DIAS_AVISO_RENOVACAO))
     except Exception as e:
-        logger.error(f"Erro ao buscar usuários expirados: {e}")
+        logger.error("Erro ao buscar usuários para aviso: %s", e)
         return []
-    finally:
-        if conn:
-            conn.close()
 
 # --- FUNÇÕES DE AGENDAMENTO (JOBS) ---
 # (Todo o código dos jobs está correto e permanece o mesmo)
@@ -211,7 +623,7 @@ async def job_abandono_carrinho(context: ContextTypes.DEFAULT_TYPE):
     user_id = job.user_id
     user_data = get_user_data(user_id)
     if user_data and user_data['status'] == 'pendente_pagamento':
-        logger.info(f"[Job] Enviando follow-up de abandono para {user_id}")
+        logger.info("[Job] Enviando follow-up de abandono para %s", user_id)
         try:
             await context.bot.send_message(
                 chat_id=user_id,
@@ -222,35 +634,24 @@ async def job_abandono_carrinho(context: ContextTypes.DEFAULT_TYPE):
                 )
             )
         except Exception as e:
-            logger.error(f"Erro ao enviar follow-up para {user_id}: {e}")
+            logger.error("Erro ao enviar follow-up para %s: %s", user_id, e)
 
 async def job_checa_aniversarios(context: ContextTypes.DEFAULT_TYPE):
     logger.info("[Job] Verificando aniversariantes do dia...")
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT user_id, telegram_username 
-            FROM usuarios 
-            WHERE EXTRACT(MONTH FROM data_aniversario) = EXTRACT(MONTH FROM CURRENT_DATE)
-            AND EXTRACT(DAY FROM data_aniversario) = EXTRACT(DAY FROM CURRENT_DATE)
-        """)
-        aniversariantes = cursor.fetchall()
-        cursor.close()
+        with UnidadeDeTrabalho() as uow:
+            aniversariantes = uow.busca_aniversariantes()
     except Exception as e:
-        logger.error(f"Erro ao buscar aniversariantes: {e}")
+        logger.error("Erro ao buscar aniversariantes: %s", e)
         aniversariantes = []
-    finally:
-        if conn:
-            conn.close()
 
     if not aniversariantes:
         logger.info("[Job] Nenhum aniversariante hoje.")
         return
 
+    amostra = AmostradorLog("aniversarios")
     for user_id, username in aniversariantes:
-        logger.info(f"[Job] Enviando parabéns para {username} ({user_id})")
+        amostra.info("[Job] Enviando parabéns para %s (%s)", username, user_id, user_id=user_id)
         try:
             await context.bot.send_message(
                 chat_id=user_id,
@@ -262,15 +663,17 @@ async def job_checa_aniversarios(context: ContextTypes.DEFAULT_TYPE):
                 )
             )
         except Exception as e:
-            logger.error(f"Erro ao enviar parabéns para {user_id}: {e}")
+            amostra.erro("Erro ao enviar parabéns para %s: %s", user_id, e, user_id=user_id)
+    amostra.resumo()
 
 async def job_aviso_renovacao(context: ContextTypes.DEFAULT_TYPE):
     logger.info("[Job] Verificando assinaturas perto de expirar...")
     usuarios = get_users_para_aviso_renovacao()
+    amostra = AmostradorLog("aviso_renovacao")
     for user_id, data_expiracao in usuarios:
         dias_restantes = (data_expiracao - datetime.now()).days
         if dias_restantes == DIAS_AVISO_RENOVACAO:
-            logger.info(f"[Job] Enviando aviso de renovação para {user_id} (expira em {dias_restantes} dias)")
+            amostra.info("[Job] Enviando aviso de renovação para %s (expira em %s dias)", user_id, dias_restantes, user_id=user_id)
             try:
                 await context.bot.send_message(
                     chat_id=user_id,
@@ -281,20 +684,28 @@ async def job_aviso_renovacao(context: ContextTypes.DEFAULT_TYPE):
                     )
                 )
             except Exception as e:
-                logger.error(f"Erro ao enviar aviso de renovação para {user_id}: {e}")
+                amostra.erro("Erro ao enviar aviso de renovação para %s: %s", user_id, e, user_id=user_id)
+    amostra.resumo()
 
 async def job_remove_expirados(context: ContextTypes.DEFAULT_TYPE):
     logger.info("[Job] Verificando membros expirados para remoção...")
-    usuarios = get_users_expirados()
+    # Os vencidos são reivindicados numa transação curta, antes das chamadas ao Telegram;
+    # nenhuma conexão fica presa durante o loop.
+    try:
+        with UnidadeDeTrabalho() as uow:
+            usuarios = uow.reivindica_vencidos()
+    except Exception as e:
+        logger.error("Erro ao buscar usuários expirados: %s", e)
+        return
     if not usuarios:
         logger.info("[Job] Nenhum membro expirado encontrado.")
         return
+    amostra = AmostradorLog("remove_expirados")
     for user_id, username in usuarios:
-        logger.warning(f"[Job] Removendo usuário expirado: {username} ({user_id})")
+        amostra.aviso("[Job] Removendo usuário expirado: %s (%s)", username, user_id, user_id=user_id)
         try:
             await context.bot.ban_chat_member(chat_id=GRUPO_ID, user_id=user_id)
             await context.bot.unban_chat_member(chat_id=GRUPO_ID, user_id=user_id)
-            update_user_status(user_id, 'expirado')
             await context.bot.send_message(
                 chat_id=user_id,
                 text=(
@@ -304,8 +715,9 @@ async def job_remove_expirados(context: ContextTypes.DEFAULT_TYPE):
                 )
             )
         except Exception as e:
-            logger.error(f"Erro ao remover {user_id}: {e}")
-            update_user_status(user_id, 'expirado')
+            amostra.erro("Erro ao remover %s: %s", user_id, e, user_id=user_id)
+        update_user_status_se(user_id, 'expirado', ['removendo'])
+    amostra.resumo()
 
 # --- FLUXO: INÍCIO E CADASTRO (/start, /acesso) ---
 # (Todo o código de /start, /acesso, cadastro e handlers está correto e permanece o mesmo)
@@ -343,14 +755,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return ConversationHandler.END
 
-    if status == 'expirado':
+    if status in ['expirado', 'removendo']:
         await update.message.reply_text(
             "Sua assinatura expirou. Para retornar, você deve renovar.\n\n"
             "Use o comando /renovar para iniciar o processo."
         )
         return ConversationHandler.END
 
-    logger.info(f"Iniciando novo cadastro para {user.username} ({user_id})")
+    logger.info("Iniciando novo cadastro para %s (%s)", user.username, user_id)
     context.user_data['telegram_username'] = user.username or f"user_{user_id}"
     
     await update.message.reply_text(
@@ -368,7 +780,7 @@ async def recebe_email(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         return EMAIL
 
     context.user_data['email'] = email
-    logger.info(f"Recebido E-mail: {email} de {update.effective_user.id}")
+    logger.info("Recebido E-mail: %s de %s", email, update.effective_user.id)
     
     await update.message.reply_text(
         "E-mail registrado.\n\n"
@@ -383,7 +795,7 @@ async def recebe_aniversario(update: Update, context: ContextTypes.DEFAULT_TYPE)
         data_obj = datetime.strptime(data_texto, "%d/%m/%Y")
         data_db = data_obj.date() 
         context.user_data['data_aniversario'] = data_db
-        logger.info(f"Recebida Data de Aniversário: {data_db} de {update.effective_user.id}")
+        logger.info("Recebida Data de Aniversário de %s", update.effective_user.id)
     except ValueError:
         await update.message.reply_text(
             "Formato de data inválido. Por favor, use exatamente `DD/MM/AAAA`.\n"
@@ -416,13 +828,13 @@ async def confirmacao_dados(update: Update, context: ContextTypes.DEFAULT_TYPE)
     update_user_data(user_id, ud['telegram_username'], ud['email'], ud['data_aniversario'])
     
     context.job_queue.run_once(
-        job_abandono_carrinho,
+        perfilado(job_abandono_carrinho),
         when=timedelta(hours=24), 
         user_id=user_id,
         name=f"abandono_{user_id}"
     )
 
-    logger.info(f"Cadastro finalizado para {user_id}. Status: pendente_pagamento.")
+    logger.info("Cadastro finalizado para %s. Status: pendente_pagamento.", user_id)
     await update.message.reply_text(
         "Cadastro salvo! Você está a um passo de servir.\n\n"
         "Seu status agora é: **PENDENTE DE PAGAMENTO**.\n\n"
@@ -437,9 +849,9 @@ async def recebe_comprovante_novo(update: Update, context: ContextTypes.DEFAULT_
     user = update.effective_user
     user_id = user.id
     
-    logger.info(f"Recebido comprovante NOVO de {user.username} ({user_id}). Encaminhando para Admin.")
+    logger.info("Recebido comprovante NOVO de %s (%s). Encaminhando para Admin.", user.username, user_id)
     
-    update_user_status(user_id, 'pendente_aprovacao_novo')
+    email = update_user_status(user_id, 'pendente_aprovacao_novo')
 
     botoes_admin = [
         [
@@ -448,7 +860,7 @@ async def recebe_comprovante_novo(update: Update, context: ContextTypes.DEFAULT_
         ]
     ]
     
-    await envia_para_admin(context, user, "Rainha, novo pedido de ACESSO:", botoes_admin, update.message)
+    await envia_para_admin(context, user, email, "Rainha, novo pedido de ACESSO:", botoes_admin, update.message)
     
     await update.message.reply_text(
         "Comprovante de NOVO MEMBRO recebido.\n\n"
@@ -460,14 +872,12 @@ async def recebe_comprovante_novo(update: Update, context: ContextTypes.DEFAULT_
 async def recebe_comprovante_renovacao(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     user_id = user.id
-    user_data = get_user_data(user_id)
+    trocou, email = update_user_status_se(user_id, 'pendente_aprovacao_renovacao', ['pendente_renovacao', 'expirado'])
     
-    if not user_data or user_data['status'] not in ['pendente_renovacao', 'expirado']:
+    if not trocou:
         return
 
-    logger.info(f"Recebido comprovante de RENOVAÇÃO de {user.username} ({user_id}). Encaminhando para Admin.")
-    
-    update_user_status(user_id, 'pendente_aprovacao_renovacao')
+    logger.info("Recebido comprovante de RENOVAÇÃO de %s (%s). Encaminhando para Admin.", user.username, user_id)
 
     botoes_admin = [
         [
@@ -476,7 +886,7 @@ async def recebe_comprovante_renovacao(update: Update, context: ContextTypes.DEF
         ]
     ]
 
-    await envia_para_admin(context, user, "Rainha, novo pedido de RENOVAÇÃO:", botoes_admin, update.message)
+    await envia_para_admin(context, user, email, "Rainha, novo pedido de RENOVAÇÃO:", botoes_admin, update.message)
     
     await update.message.reply_text(
         "Comprovante de RENOVAÇÃO recebido.\n\n"
@@ -484,10 +894,9 @@ async def recebe_comprovante_renovacao(update: Update, context: ContextTypes.DEF
         "Por favor, aguarde pacientemente."
     )
 
-async def envia_para_admin(context, user, texto_cabecalho, botoes, message_comprovante):
+async def envia_para_admin(context, user, email, texto_cabecalho, botoes, message_comprovante):
     try:
-        user_data = get_user_data(user.id)
-        detalhes_usuario = f"Usuário: @{user.username} (ID: {user.id})\nEmail: {user_data.get('email', 'N/A')}"
+        detalhes_usuario = f"Usuário: @{user.username} (ID: {user.id})\nEmail: {email or 'N/A'}"
         
         await context.bot.send_message(
             chat_id=ADMIN_ID,
@@ -500,7 +909,7 @@ async def envia_para_admin(context, user, texto_cabecalho, botoes, message_compr
             reply_markup=InlineKeyboardMarkup(botoes)
         )
     except Exception as e:
-        logger.error(f"Falha ao enviar comprovante de {user.id} para o Admin: {e}")
+        logger.error("Falha ao enviar comprovante de %s para o Admin: %s", user.id, e)
 
 async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -514,13 +923,13 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
         acao, tipo, user_id_str = query.data.split("_")
         user_id = int(user_id_str)
     except ValueError:
-        logger.error(f"Callback mal formatado recebido: {query.data}")
+        logger.error("Callback mal formatado recebido: %s", query.data)
         await query.edit_message_text(text="ERRO: Callback mal formatado.")
         return
 
     if acao == "aprovar":
         if tipo == "novo":
-            logger.info(f"Admin aprovou NOVO MEMBRO {user_id}")
+            logger.info("Admin aprovou NOVO MEMBRO %s", user_id)
             
             data_expiracao = datetime.now() + timedelta(days=DIAS_ASSINATURA)
             update_user_expiry(user_id, data_expiracao)
@@ -546,21 +955,16 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
                 await query.edit_message_text(text=f"✅ Acesso de NOVO MEMBRO {user_id} APROVADO.")
             
             except Exception as e:
-                logger.error(f"Erro ao criar link ou enviar para {user_id}: {e}")
+                logger.error("Erro ao criar link ou enviar para %s: %s", user_id, e)
                 await query.edit_message_text(text=f"ERRO ao aprovar {user_id}. Verifique os logs.")
 
         elif tipo == "renovacao":
-            logger.info(f"Admin aprovou RENOVAÇÃO para {user_id}")
+            logger.info("Admin aprovou RENOVAÇÃO para %s", user_id)
             
-            user_data = get_user_data(user_id)
-            data_expira_atual = user_data['data_expiracao'] if user_data else None
-            
-            base_data = datetime.now() 
-            if data_expira_atual:
-                base_data = max(datetime.now(), data_expira_atual)
-                
-            nova_data_expiracao = base_data + timedelta(days=DIAS_ASSINATURA)
-            update_user_expiry(user_id, nova_data_expiracao)
+            nova_data_expiracao = renova_assinatura(user_id)
+            if nova_data_expiracao is None:
+                await query.edit_message_text(text=f"ERRO ao renovar {user_id}: usuário não encontrado ou falha no banco. Verifique os logs.")
+                return
             
             await context.bot.send_message(
                 chat_id=user_id,
@@ -572,7 +976,7 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
 
     elif acao == "recusar":
         if tipo == "novo":
-            logger.info(f"Admin recusou NOVO MEMBRO {user_id}")
+            logger.info("Admin recusou NOVO MEMBRO %s", user_id)
             update_user_status(user_id, 'recusado')
             await context.bot.send_message(
                 chat_id=user_id,
@@ -582,15 +986,9 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
             await query.edit_message_text(text=f"❌ Acesso de NOVO MEMBRO {user_id} RECUSADO.")
         
         elif tipo == "renovacao":
-            logger.info(f"Admin recusou RENOVAÇÃO para {user_id}")
-            
-            user_data = get_user_data(user_id)
-            status_anterior = 'expirado' 
-            if user_data and user_data['data_expiracao']:
-                if user_data['data_expiracao'] > datetime.now():
-                    status_anterior = 'membro_ativo'
+            logger.info("Admin recusou RENOVAÇÃO para %s", user_id)
             
-            update_user_status(user_id, status_anterior)
+            restaura_status_apos_recusa(user_id)
             
             await context.bot.send_message(
                 chat_id=user_id,
@@ -602,15 +1000,13 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
 
 async def renovar_acesso(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user_data = get_user_data(user_id)
-    status = user_data['status'] if user_data else None
+    trocou, _ = update_user_status_se(user_id, 'pendente_renovacao', ['membro_ativo', 'expirado', 'removendo', 'pendente_renovacao'])
 
-    if status not in ['membro_ativo', 'expirado', 'pendente_renovacao']:
+    if not trocou:
         await update.message.reply_text("Você precisa ser um membro (ativo ou expirado) para renovar. Use /acesso para iniciar seu cadastro.")
         return
 
-    update_user_status(user_id, 'pendente_renovacao')
-    logger.info(f"Usuário {user_id} iniciou fluxo de renovação.")
+    logger.info("Usuário %s iniciou fluxo de renovação.", user_id)
     
     await update.message.reply_text(
         "Você solicitou a renovação da sua assinatura.\n\n"
@@ -627,17 +1023,66 @@ async def cancelar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     for job in jobs:
         job.schedule_removal()
 
-    user_data = get_user_data(user_id)
-    if user_data and user_data['status'] == 'pendente_pagamento':
-         update_user_status(user_id, 'recusado')
+    update_user_status_se(user_id, 'recusado', ['pendente_pagamento'])
 
-    logger.info(f"Usuário {user_id} cancelou o cadastro.")
+    logger.info("Usuário %s cancelou o cadastro.", user_id)
     await update.message.reply_text(
         "Processo cancelado. Você pode recomeçar a qualquer momento usando /acesso.",
         reply_markup=ReplyKeyboardRemove(),
     )
     return ConversationHandler.END
 
+async def perfil_comando(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/perfil [on|off|limiar MS|amostra SEGUNDOS] — só para o Admin."""
+    if update.effective_user.id != ADMIN_ID:
+        return
+
+    args = context.args
+    if args and args[0] in ("on", "off"):
+        ESTADO_PERFIL["ativo"] = args[0] == "on"
+        logger.info("Perfil de updates %s pelo Admin.", "ligado" if ESTADO_PERFIL["ativo"] else "desligado")
+    elif len(args) == 2 and args[0] == "limiar" and args[1].isdigit():
+        ESTADO_PERFIL["limiar_ms"] = float(args[1])
+    elif args and args[0] == "amostra":
+        if ESTADO_PERFIL["amostrando"]:
+            await update.message.reply_text("Já existe uma amostragem em andamento.")
+            return
+        segundos = int(args[1]) if len(args) > 1 and args[1].isdigit() else 30
+        segundos = min(max(segundos, 1), PERFIL_AMOSTRA_MAX_S)
+        ESTADO_PERFIL["amostrando"] = True
+        # Roda em segundo plano para não segurar a fila de updates durante a amostragem.
+        context.application.create_task(_envia_amostra(context.bot, threading.get_ident(), segundos))
+        await update.message.reply_text(f"Amostrando o bot por {segundos} s. O arquivo será enviado ao final.")
+        return
+    elif args:
+        await update.message.reply_text("Uso: /perfil [on|off|limiar MS|amostra SEGUNDOS]")
+        return
+
+    await update.message.reply_text(
+        f"Perfil: {'ligado' if ESTADO_PERFIL['ativo'] else 'desligado'}\n"
+        f"Limiar de update lento: {ESTADO_PERFIL['limiar_ms']:.0f} ms"
+    )
+
+async def _envia_amostra(bot, thread_id, segundos):
+    try:
+        contagens = await asyncio.to_thread(amostra_pilhas, thread_id, segundos)
+        logger.info("Amostragem de %s s concluída (%d amostras)", segundos, sum(contagens.values()))
+        if not contagens:
+            await bot.send_message(chat_id=ADMIN_ID, text="A amostragem não coletou nenhuma pilha.")
+            return
+        # Enviado da memória: nada fica gravado no disco do servidor.
+        arquivo = io.BytesIO(formata_flamegraph(contagens).encode("utf-8"))
+        await bot.send_document(
+            chat_id=ADMIN_ID,
+            document=arquivo,
+            filename=f"perfil_{datetime.now():%Y%m%d_%H%M%S}.folded",
+            caption="Perfil (formato folded, p/ flamegraph)",
+        )
+    except Exception as e:
+        logger.error("Erro na amostragem de perfil: %s", e)
+    finally:
+        ESTADO_PERFIL["amostrando"] = False
+
 # --- FUNÇÃO PRINCIPAL (MAIN) DO BOT ---
 
 def run_bot() -> None:
@@ -651,12 +1096,13 @@ def run_bot() -> None:
     
     inicializar_db()
     
-    application = Application.builder().token(TOKEN).build()
+    # Mesmo tamanho de pool que o builder usaria por padrão; só adiciona a medição de tempo.
+    application = Application.builder().token(TOKEN).request(RequestCronometrado(connection_pool_size=256)).build()
 
     job_queue = application.job_queue
-    job_queue.run_daily(job_checa_aniversarios, time=datetime.strptime("09:00", "%H:%M").time())
-    job_queue.run_daily(job_aviso_renovacao, time=datetime.strptime("10:00", "%H:%M").time())
-    job_queue.run_daily(job_remove_expirados, time=datetime.strptime("01:00", "%H:%M").time())
+    job_queue.run_daily(perfilado(job_checa_aniversarios), time=datetime.strptime("09:00", "%H:%M").time())
+    job_queue.run_daily(perfilado(job_aviso_renovacao), time=datetime.strptime("10:00", "%H:%M").time())
+    job_queue.run_daily(perfilado(job_remove_expirados), time=datetime.strptime("01:00", "%H:%M").time())
     
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start), CommandHandler("acesso", start)],
@@ -674,6 +1120,8 @@ def run_bot() -> None:
     application.add_handler(CallbackQueryHandler(admin_callback_handler))
     application.add_handler(CommandHandler("renovar", renovar_acesso))
     application.add_handler(MessageHandler(filters.PHOTO & (~filters.UpdateType.EDITED_MESSAGE) & (~filters.ChatType.GROUP), recebe_comprovante_renovacao))
+    application.add_handler(CommandHandler("perfil", perfil_comando))
+    instrumenta_handlers(application)
 
     logger.info("Bot v4.1 (Neon DB + Async Fix) iniciado com sucesso.")
     application.run_polling() # Esta linha agora funcionará
@@ -690,7 +1138,7 @@ def health_check():
 def run_web_server():
     """Inicia o servidor web do Flask."""
     port = int(os.environ.get('PORT', 8080))
-    logger.info(f"Iniciando servidor web na porta {port}")
+    logger.info("Iniciando servidor web na porta %s", port)
     web_app.run(host='0.0.0.0', port=port)
 
 
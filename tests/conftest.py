@@ -0,0 +1,10 @@
+import os
+import sys
+
+# O módulo lê a configuração do ambiente na importação.
+os.environ.setdefault("TELEGRAM_TOKEN", "123:teste")
+os.environ.setdefault("ADMIN_ID", "1")
+os.environ.setdefault("GRUPO_ID", "-100")
+os.environ.setdefault("DATABASE_URL", "postgresql://teste@localhost/teste")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,332 @@
+import asyncio
+import logging
+import re
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock
+
+import psycopg2
+import psycopg2.errors
+import pytest
+
+import guardian_bot_pro as bot
+
+# SQL enviado sem PREPARE -> nome da consulta em CONSULTAS.
+_SEM_PREPARE = {bot._REGEX_PARAMETRO.sub(r"%(p\1)s", sql): nome for nome, (_, sql) in bot.CONSULTAS.items()}
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.description = None
+        self._linhas = []
+
+    def execute(self, sql, params=None):
+        if not self.conn.em_transacao:
+            self.conn.em_transacao = True
+            self.conn.round_trips += 1  # BEGIN
+        self.conn.round_trips += 1
+        self.conn.comandos.append(sql)
+        if self.conn.abortada:
+            raise psycopg2.errors.InFailedSqlTransaction("current transaction is aborted")
+        if self.conn.falhas:
+            self.conn.abortada = True
+            raise self.conn.falhas.pop(0)
+        executa = re.search(r"EXECUTE (\w+)", sql)
+        nome = executa.group(1) if executa else _SEM_PREPARE[sql]
+        self.description, self._linhas = self.conn.respostas.get(nome, ([("x",)], []))
+
+    def fetchone(self):
+        return self._linhas[0] if self._linhas else None
+
+    def fetchall(self):
+        return list(self._linhas)
+
+
+class FakeConexao:
+    def __init__(self, respostas, falhas):
+        self.respostas = respostas
+        self.falhas = falhas
+        self.preparadas = set()
+        self.closed = 0
+        self.em_transacao = False
+        self.abortada = False
+        self.round_trips = 0
+        self.comandos = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.em_transacao = self.abortada = False
+        self.round_trips += 1
+
+    rollback = commit
+
+    def get_transaction_status(self):
+        if self.abortada:
+            return psycopg2.extensions.TRANSACTION_STATUS_INERROR
+        if self.em_transacao:
+            return psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def banco(monkeypatch):
+    """Troca a conexão real por uma FakeConexao e conta conexões abertas."""
+    estado = {"conexoes": 0, "ultima": None, "respostas": {}, "falhas": []}
+
+    def conecta():
+        estado["conexoes"] += 1
+        estado["ultima"] = FakeConexao(estado["respostas"], estado["falhas"])
+        return estado["ultima"]
+
+    monkeypatch.setattr(bot, "DB_USA_PREPARE", True)
+    monkeypatch.setattr(bot, "get_db_connection", conecta)
+    monkeypatch.setattr(bot, "POOL", bot.PoolConexoes())
+    monkeypatch.setattr(bot.UnidadeDeTrabalho, "total_round_trips", 0)
+    return estado
+
+
+def _update(user_id=10):
+    update = MagicMock()
+    update.effective_user.id = user_id
+    update.effective_user.username = "servo"
+    update.message.reply_text = AsyncMock()
+    update.message.forward = AsyncMock()
+    return update
+
+
+def _context():
+    context = MagicMock()
+    context.bot = AsyncMock()
+    context.args = []
+    return context
+
+
+def _callback(data):
+    update = MagicMock()
+    update.callback_query.data = data
+    update.callback_query.from_user.id = bot.ADMIN_ID
+    update.callback_query.answer = AsyncMock()
+    update.callback_query.edit_message_text = AsyncMock()
+    return update
+
+
+def _usuarios(n):
+    return [(i, f"user_{i}") for i in range(n)]
+
+
+# cenário -> (round trips, conexões abertas)
+ESPERADO = {
+    "recebe_comprovante_novo": (3, 1),
+    "recebe_comprovante_renovacao": (3, 1),
+    "aprova_renovacao": (3, 1),
+    "renovar_acesso": (3, 1),
+    # reivindicação + um UPDATE condicional por usuário, tudo na mesma conexão do pool
+    "job_remove_expirados_10": (3 + 10 * 3, 1),
+}
+
+
+def _cenarios(banco):
+    expira = datetime.now() + timedelta(days=40)
+    banco["respostas"].update({
+        "atualiza_status": ([("email",)], [("a@b.com",)]),
+        "troca_status_se": ([("email",)], [("a@b.com",)]),
+        "renova": ([("data_expiracao",)], [(expira,)]),
+        "reivindica_vencidos": ([("user_id",), ("telegram_username",)], _usuarios(10)),
+    })
+    return {
+        "recebe_comprovante_novo": lambda: bot.recebe_comprovante_novo(_update(), _context()),
+        "recebe_comprovante_renovacao": lambda: bot.recebe_comprovante_renovacao(_update(), _context()),
+        "aprova_renovacao": lambda: bot.admin_callback_handler(_callback("aprovar_renovacao_10"), _context()),
+        "renovar_acesso": lambda: bot.renovar_acesso(_update(), _context()),
+        "job_remove_expirados_10": lambda: bot.job_remove_expirados(_context()),
+    }
+
+
+@pytest.mark.parametrize("cenario", sorted(ESPERADO))
+def test_round_trips_e_conexoes_por_update(banco, cenario):
+    asyncio.run(_cenarios(banco)[cenario]())
+
+    assert (bot.UnidadeDeTrabalho.total_round_trips, banco["conexoes"]) == ESPERADO[cenario]
+
+
+def test_prepare_so_na_primeira_vez_por_conexao(banco):
+    bot.update_user_status(10, "recusado")
+    bot.update_user_status(11, "recusado")
+
+    comandos = banco["ultima"].comandos
+    assert banco["conexoes"] == 1
+    assert comandos[0].startswith("PREPARE atualiza_status (bigint, text) AS")
+    assert comandos[1] == "EXECUTE atualiza_status(%s, %s)"
+
+
+def test_erro_no_prepare_descarta_a_conexao(banco):
+    with pytest.raises(RuntimeError):
+        with bot.UnidadeDeTrabalho() as uow:
+            uow.conn.cursor = lambda: MagicMock(execute=MagicMock(side_effect=RuntimeError))
+            uow.atualiza_status(10, "x")
+
+    assert banco["ultima"].closed
+    assert not bot.POOL._livres
+
+
+@pytest.mark.parametrize("usa_prepare", [False, True])
+def test_erro_de_sql_nao_deixa_conexao_abortada_no_pool(banco, monkeypatch, usa_prepare):
+    monkeypatch.setattr(bot, "DB_USA_PREPARE", usa_prepare)
+    banco["respostas"]["atualiza_status"] = ([("email",)], [("a@b.com",)])
+    banco["falhas"].append(psycopg2.errors.InvalidTextRepresentation("valor inválido"))
+
+    assert bot.update_user_status(10, "x") is None
+    assert bot.update_user_status(10, "y") == "a@b.com"
+    assert bot.update_user_status(10, "z") == "a@b.com"
+
+
+def test_sem_prepare_envia_sql_com_parametros_nomeados(banco, monkeypatch):
+    monkeypatch.setattr(bot, "DB_USA_PREPARE", False)
+
+    bot.update_user_status_se(10, "recusado", ["pendente_pagamento"])
+
+    assert banco["ultima"].comandos == [
+        "UPDATE usuarios SET status = %(p2)s WHERE user_id = %(p1)s AND status = ANY(%(p3)s) RETURNING email"
+    ]
+    assert banco["conexoes"] == 1
+
+
+def test_remove_expirados_nao_segura_transacao_durante_o_telegram(banco):
+    banco["respostas"]["reivindica_vencidos"] = ([("user_id",), ("telegram_username",)], _usuarios(2))
+    context = _context()
+
+    async def sem_transacao(**kwargs):
+        assert not banco["ultima"].em_transacao
+
+    context.bot.ban_chat_member.side_effect = sem_transacao
+    asyncio.run(bot.job_remove_expirados(context))
+
+    assert context.bot.ban_chat_member.await_count == 2
+
+
+def test_aprova_renovacao_sem_linha_avisa_admin_e_nao_confirma(banco):
+    update = _callback("aprovar_renovacao_10")
+    context = _context()
+
+    asyncio.run(bot.admin_callback_handler(update, context))
+
+    context.bot.send_message.assert_not_awaited()
+    assert "ERRO" in update.callback_query.edit_message_text.await_args.kwargs["text"]
+
+
+@pytest.mark.parametrize("nome", sorted(bot.CONSULTAS))
+def test_consultas_sao_sql_valido(nome):
+    pglast = pytest.importorskip("pglast")
+    tipos, sql = bot.CONSULTAS[nome]
+    assinatura = f" ({tipos})" if tipos else ""
+
+    pglast.parse_sql(sql)
+    pglast.parse_sql(f"PREPARE {nome}{assinatura} AS {sql}")
+
+
+# --- Contra um PostgreSQL de verdade (pgserver), quando disponível ---
+
+@pytest.fixture(scope="module")
+def postgres(tmp_path_factory):
+    pgserver = pytest.importorskip("pgserver")
+    # O pgserver loga ao encerrar o processo, quando a captura do pytest já fechou o stderr.
+    logging.getLogger("pgserver").setLevel(logging.WARNING)
+    servidor = pgserver.get_server(tmp_path_factory.mktemp("pg"), cleanup_mode="stop")
+    yield servidor.get_uri()
+    servidor.cleanup()
+
+
+@pytest.fixture(params=[True, False], ids=["prepare", "sem_prepare"])
+def pg(request, postgres, monkeypatch):
+    monkeypatch.setattr(bot, "DATABASE_URL", postgres)
+    monkeypatch.setattr(bot, "DB_USA_PREPARE", request.param)
+    monkeypatch.setattr(bot, "POOL", bot.PoolConexoes())
+    bot.inicializar_db()
+    conn = psycopg2.connect(postgres)
+    conn.autocommit = True
+    conn.cursor().execute("TRUNCATE usuarios")
+    yield conn
+    conn.close()
+    for livre in bot.POOL._livres:
+        livre.close()
+
+
+def _insere(conn, user_id, status, data_expiracao):
+    conn.cursor().execute(
+        "INSERT INTO usuarios (user_id, telegram_username, email, status, data_expiracao) VALUES (%s, %s, %s, %s, %s)",
+        (user_id, f"user_{user_id}", f"u{user_id}@x.com", status, data_expiracao),
+    )
+
+
+def _status(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT user_id, status FROM usuarios ORDER BY user_id")
+    return dict(cursor.fetchall())
+
+
+class ProcessoParado(BaseException):
+    """Simula o processo morrendo no meio do job (não é pego pelo `except Exception`)."""
+
+
+def test_remove_expirados_retoma_sobras_apos_interrupcao(pg):
+    ontem = datetime.now() - timedelta(days=1)
+    for user_id in (1, 2, 3):
+        _insere(pg, user_id, "membro_ativo", ontem)
+    _insere(pg, 4, "membro_ativo", datetime.now() + timedelta(days=10))
+
+    context = _context()
+
+    async def para_no_segundo(chat_id, user_id):
+        if user_id == 2:
+            raise ProcessoParado
+
+    context.bot.ban_chat_member.side_effect = para_no_segundo
+    with pytest.raises(ProcessoParado):
+        asyncio.run(bot.job_remove_expirados(context))
+
+    assert _status(pg) == {1: "expirado", 2: "removendo", 3: "removendo", 4: "membro_ativo"}
+
+    context = _context()
+    asyncio.run(bot.job_remove_expirados(context))
+
+    assert _status(pg) == {1: "expirado", 2: "expirado", 3: "expirado", 4: "membro_ativo"}
+    assert sorted(c.kwargs["user_id"] for c in context.bot.ban_chat_member.await_args_list) == [2, 3]
+
+
+def test_renovacao_aprovada_durante_remocao_nao_e_sobrescrita(pg):
+    _insere(pg, 1, "membro_ativo", datetime.now() - timedelta(days=1))
+    context = _context()
+
+    async def admin_renova_no_meio(chat_id, user_id):
+        bot.renova_assinatura(user_id)
+
+    context.bot.ban_chat_member.side_effect = admin_renova_no_meio
+    asyncio.run(bot.job_remove_expirados(context))
+
+    assert _status(pg) == {1: "membro_ativo"}
+
+
+def test_erro_de_sql_real_nao_envenena_o_pool(pg):
+    _insere(pg, 1, "membro_ativo", None)
+
+    bot.update_user_data(1, "user_1", "u1@x.com", "não é data")
+    assert bot.update_user_status(1, "recusado") == "u1@x.com"
+    assert _status(pg) == {1: "recusado"}
+
+
+def test_fluxo_de_renovacao_no_banco(pg):
+    daqui_5 = datetime.now() + timedelta(days=5)
+    _insere(pg, 1, "membro_ativo", daqui_5)
+
+    assert bot.update_user_status_se(1, "pendente_renovacao", ["membro_ativo"]) == (True, "u1@x.com")
+    assert bot.update_user_status_se(1, "x", ["expirado"]) == (False, None)
+    nova = bot.renova_assinatura(1)
+    assert nova.date() == (daqui_5 + timedelta(days=bot.DIAS_ASSINATURA)).date()
+    assert bot.renova_assinatura(999) is None
+    bot.restaura_status_apos_recusa(1)
+    assert bot.get_user_data(1)["status"] == "membro_ativo"
@@ -0,0 +1,61 @@
+import logging
+
+import guardian_bot_pro as bot
+
+
+def _registro(msg, *args, exc_info=None):
+    return logging.LogRecord("teste", logging.ERROR, __file__, 1, msg, args, exc_info)
+
+
+def test_filtro_pii_mascara_argumentos_que_nao_sao_str():
+    erro = Exception("DETAIL: Key (email)=(joao@exemplo.com) already exists.")
+    registro = _registro("Erro ao atualizar dados de %s: %s", 42, erro)
+
+    bot.FiltroPII().filter(registro)
+
+    assert registro.getMessage() == "Erro ao atualizar dados de 42: DETAIL: Key (email)=(j***@exemplo.com) already exists."
+
+
+def test_filtro_pii_mascara_traceback():
+    try:
+        raise ValueError("falhou para maria@exemplo.com")
+    except ValueError:
+        registro = _registro("erro", exc_info=bot.sys.exc_info())
+
+    bot.FiltroPII().filter(registro)
+
+    assert "maria@exemplo.com" not in registro.exc_text
+    assert "m***@exemplo.com" in registro.exc_text
+
+
+def test_queue_handler_guarda_traceback_como_texto():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        registro = _registro("erro", exc_info=bot.sys.exc_info())
+
+    preparado = bot.QueueHandlerPreguicoso(bot.queue.SimpleQueue()).prepare(registro)
+
+    assert preparado.exc_info is None
+    assert "ValueError: boom" in preparado.exc_text
+
+
+def test_amostrador_loga_so_as_primeiras_linhas_e_um_resumo(caplog):
+    amostra = bot.AmostradorLog("teste", limite=3)
+
+    with caplog.at_level(logging.INFO, logger=bot.logger.name):
+        for user_id in range(10):
+            amostra.info("Enviando para %s", user_id, user_id=user_id)
+            if user_id in (5, 8):
+                amostra.erro("Erro ao enviar para %s", user_id, user_id=user_id)
+        amostra.resumo()
+
+    registros = [r for r in caplog.records if getattr(r, "job", None) == "teste"]
+    assert [r.getMessage() for r in registros if r.levelno == logging.INFO][:3] == [
+        "Enviando para 0", "Enviando para 1", "Enviando para 2"
+    ]
+    assert [r.user_id for r in registros if r.levelno == logging.ERROR] == [5, 8]
+    resumo = registros[-1]
+    assert (resumo.processados, resumo.erros) == (10, 2)
+    assert "(7 omitidos do log)" in resumo.getMessage()
+    assert len(registros) == 3 + 2 + 1
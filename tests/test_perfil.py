@@ -0,0 +1,111 @@
+import asyncio
+import collections
+import io
+import logging
+import time
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from telegram.ext import Application, CommandHandler, ConversationHandler, MessageHandler, filters
+
+import guardian_bot_pro as bot
+
+
+@pytest.fixture
+def perfil(monkeypatch):
+    monkeypatch.setitem(bot.ESTADO_PERFIL, "ativo", True)
+    monkeypatch.setitem(bot.ESTADO_PERFIL, "limiar_ms", 0)
+    monkeypatch.setitem(bot.ESTADO_PERFIL, "amostrando", False)
+    return bot.ESTADO_PERFIL
+
+
+async def entrada(update, context):
+    return 1
+
+
+async def estado(update, context):
+    return 2
+
+
+async def saida(update, context):
+    return ConversationHandler.END
+
+
+async def avulso(update, context):
+    return None
+
+
+def test_instrumenta_handlers_envolve_conversation_handler():
+    application = Application.builder().token("123:teste").build()
+    conversa = ConversationHandler(
+        entry_points=[CommandHandler("start", entrada)],
+        states={1: [MessageHandler(filters.TEXT, estado)]},
+        fallbacks=[CommandHandler("cancelar", saida)],
+    )
+    application.add_handler(conversa)
+    application.add_handler(CommandHandler("renovar", avulso))
+
+    bot.instrumenta_handlers(application)
+
+    handlers = conversa.entry_points + conversa.states[1] + conversa.fallbacks + application.handlers[0][1:]
+    assert [h.callback.__wrapped__ for h in handlers] == [entrada, estado, saida, avulso]
+    assert [asyncio.run(h.callback(None, None)) for h in handlers] == [1, 2, ConversationHandler.END, None]
+
+
+def test_update_lento_loga_db_telegram_e_cpu(perfil, caplog):
+    async def handler(update, context):
+        with bot.span("db"):
+            time.sleep(0.02)
+        with bot.span("telegram"):
+            await asyncio.sleep(0.03)
+        return "ok"
+
+    with caplog.at_level(logging.WARNING, logger=bot.logger.name):
+        assert asyncio.run(bot.perfilado(handler)(None, None)) == "ok"
+
+    registro = next(r for r in caplog.records if getattr(r, "handler", None) == "handler")
+    assert registro.db_ms >= 20
+    assert registro.telegram_ms >= 30
+    assert registro.total_ms == pytest.approx(registro.db_ms + registro.telegram_ms + registro.cpu_ms, abs=0.5)
+
+
+def test_perfil_desligado_nao_cria_span(perfil, caplog):
+    perfil["ativo"] = False
+    vistos = []
+
+    async def handler(update, context):
+        vistos.append(bot._SPAN_ATUAL.get())
+        return 3
+
+    with caplog.at_level(logging.WARNING, logger=bot.logger.name):
+        assert asyncio.run(bot.perfilado(handler)(None, None)) == 3
+
+    assert vistos == [None]
+    assert not [r for r in caplog.records if hasattr(r, "total_ms")]
+
+
+@pytest.mark.parametrize("pedido, esperado", [("999999", 300), ("0", 1), ("45", 45)])
+def test_amostra_limita_duracao(perfil, pedido, esperado):
+    update = MagicMock()
+    update.effective_user.id = bot.ADMIN_ID
+    update.message.reply_text = AsyncMock()
+    context = MagicMock()
+    context.args = ["amostra", pedido]
+    context.application.create_task = lambda coro: coro.close()
+
+    asyncio.run(bot.perfil_comando(update, context))
+
+    assert f"por {esperado} s" in update.message.reply_text.await_args.args[0]
+
+
+def test_envia_amostra_da_memoria(perfil, monkeypatch):
+    monkeypatch.setattr(bot, "amostra_pilhas", lambda thread_id, segundos: collections.Counter({"a;b": 3}))
+    telegram = AsyncMock()
+    perfil["amostrando"] = True
+
+    asyncio.run(bot._envia_amostra(telegram, 0, 1))
+
+    documento = telegram.send_document.await_args.kwargs["document"]
+    assert isinstance(documento, io.BytesIO)
+    assert documento.getvalue() == b"a;b 3\n"
+    assert perfil["amostrando"] is False